@@ -2,10 +2,7 @@
 import sys
 import os
 import json
-import torch
-import numpy as np
 from PIL import Image
-from torchvision import transforms
 
 import contextlib
 
@@ -23,9 +20,50 @@ def strict_stdout():
         sys.stdout = original_stdout
 
 from ml_engine.services.inference import ModelInferenceService
+from ml_engine.utils.profiling import InferenceProfiler
+
+def pop_option(args, name, default=None, has_value=True):
+    """
+    Remove an optional flag from the argument list.
+    Returns its value (or True for bare flags), or `default` if absent.
+    """
+    if name not in args:
+        return default
+    idx = args.index(name)
+    if not has_value:
+        del args[idx]
+        return True
+    if idx + 1 >= len(args):
+        raise ValueError(f"Missing value for {name}")
+    value = args[idx + 1]
+    del args[idx:idx + 2]
+    return value
 
 def main():
     with strict_stdout() as real_stdout:
+        try:
+            # Optional flags:
+            #   --profile            include the stage timing snapshot in the JSON result
+            #   --profile-log FILE   JSONL file the timings of every run are appended to, so percentiles
+            #                        cover past runs too (default ml_engine/profiles/latency.jsonl with --profile)
+            #   --trace-dir DIR      write torch.profiler op tables / Chrome traces to DIR
+            #   --trace-rate F       fraction of requests to capture (default 1.0 when --trace-dir is set);
+            #                        captured requests are left out of the histograms and the log
+            #   --student            use the distilled lightweight encoder (weights/student.pth)
+            #   --progressive        stream a 16³ preview, then the sparse-refined 32³ result, one JSON message per line
+            include_profile = pop_option(sys.argv, "--profile", False, has_value=False)
+            profile_log = pop_option(
+                sys.argv, "--profile-log",
+                os.path.join("ml_engine", "profiles", "latency.jsonl") if include_profile else None
+            )
+            trace_dir = pop_option(sys.argv, "--trace-dir")
+            trace_rate = float(pop_option(sys.argv, "--trace-rate", 1.0 if trace_dir else 0.0))
+            use_student = pop_option(sys.argv, "--student", False, has_value=False)
+            progressive = pop_option(sys.argv, "--progressive", False, has_value=False)
+        except ValueError as e:
+            real_stdout.write(json.dumps({"error": str(e)}))
+            sys.exit(1)
+
         if len(sys.argv) > 1 and sys.argv[1] == "--train":
             from ml_engine.train import train
             try:
@@ -45,6 +83,55 @@ def main():
                 real_stdout.write(json.dumps({"error": str(e)}))
             sys.exit(0)
 
+        if len(sys.argv) > 1 and sys.argv[1] == "--distill":
+            from ml_engine.distill import distill
+            try:
+                epochs = 30
+                if len(sys.argv) > 2:
+                    try:
+                        epochs = int(sys.argv[2])
+                    except ValueError:
+                        real_stdout.write(json.dumps({"error": "Invalid epoch count"}))
+                        sys.exit(1)
+
+                report = distill(epochs=epochs)
+                real_stdout.write(json.dumps({"status": "success", "message": f"Distillation completed for {epochs} epochs", "report": report}))
+            except Exception as e:
+                real_stdout.write(json.dumps({"error": str(e)}))
+            sys.exit(0)
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--train-head":
+            from ml_engine.progressive import train_occupancy_head
+            try:
+                epochs = 10
+                if len(sys.argv) > 2:
+                    try:
+                        epochs = int(sys.argv[2])
+                    except ValueError:
+                        real_stdout.write(json.dumps({"error": "Invalid epoch count"}))
+                        sys.exit(1)
+
+                report = train_occupancy_head(epochs=epochs)
+                real_stdout.write(json.dumps({"status": "success", "message": f"Occupancy head trained for {epochs} epochs", "report": report}))
+            except Exception as e:
+                real_stdout.write(json.dumps({"error": str(e)}))
+            sys.exit(0)
+
+        if len(sys.argv) > 1 and sys.argv[1] == "--sweep":
+            from ml_engine.sweep import run_sweep
+            try:
+                if len(sys.argv) < 3:
+                    real_stdout.write(json.dumps({"error": "No sweep spec provided"}))
+                    sys.exit(1)
+                with open(sys.argv[2]) as f:
+                    spec = json.load(f)
+
+                results = run_sweep(spec)
+                real_stdout.write(json.dumps({"status": "success", "best": results[0], "results": results}))
+            except Exception as e:
+                real_stdout.write(json.dumps({"error": str(e)}))
+            sys.exit(0)
+
         if len(sys.argv) < 2:
             real_stdout.write(json.dumps({"error": "No image path provided"}))
             sys.exit(1)
@@ -52,41 +139,46 @@ def main():
         image_path = sys.argv[1]
     
         try:
-            # Preprocess Image
-            transform = transforms.Compose([
-                transforms.Resize((256, 256)),
-                transforms.ToTensor(),
-                # Normalization (optional, match training)
-            ])
-            
-            image = Image.open(image_path).convert('RGB')
-            input_tensor = transform(image).unsqueeze(0) # (1, 3, 256, 256)
-
-            # Run Inference
-            weights_path = os.path.join("ml_engine", "weights", "latest.pth")
+            weights_name = "student.pth" if use_student else "latest.pth"
+            weights_path = os.path.join("ml_engine", "weights", weights_name)
             if not os.path.exists(weights_path):
+                if use_student:
+                    real_stdout.write(json.dumps({"error": "Student weights not found, run --distill first"}))
+                    sys.exit(1)
                 weights_path = None
                 
-            service = ModelInferenceService(weights_path=weights_path, device="cpu") 
-            output_voxels = service.generate_from_image(input_tensor)
-            
-            # Convert tensor to list for JSON serialization
-            # Squeeze batch dimension and traverse
-            # We output a sparse list of active voxels for efficiency
+            profiler = InferenceProfiler(trace_dir=trace_dir, trace_rate=trace_rate, log_path=profile_log)
+            service = ModelInferenceService(
+                weights_path=weights_path,
+                device="cpu",
+                profiler=profiler,
+                encoder_type="lightweight" if use_student else "resnet18",
+                head_path=os.path.join("ml_engine", "weights", "occupancy_head.pth") if progressive else None
+            )
             
-            # Simple dense array for now for simplicity in visualization prototype
-            # Thresholding at 0.5
-            active_voxels = (output_voxels > 0.5).int().squeeze().numpy()
+            if progressive:
+                with profiler.request():
+                    input_tensor = service.preprocess(Image.open(image_path))
+                    for message in service.generate_progressive(input_tensor):
+                        real_stdout.write(json.dumps(message) + "\n")
+                        real_stdout.flush()
+                if include_profile:
+                    real_stdout.write(json.dumps({"status": "profile", "profile": profiler.snapshot()}) + "\n")
+                return
             
-            # Get coordinates of active voxels
-            coords = np.argwhere(active_voxels == 1).tolist()
+            with profiler.request():
+                # Preprocess Image -> (1, 3, 256, 256)
+                input_tensor = service.preprocess(Image.open(image_path))
+                
+                # Run Inference
+                output_voxels = service.generate_from_image(input_tensor)
+                
+                # Thresholding at 0.5, then a sparse list of active voxels for efficiency
+                active_voxels = service.threshold(output_voxels)
+                result = service.serialize(active_voxels)
             
-            result = {
-                "status": "success",
-                "model_shape": list(active_voxels.shape),
-                "voxel_count": len(coords),
-                "voxels": coords # List of [z, y, x]
-            }
+            if include_profile:
+                result["profile"] = profiler.snapshot()
             
             real_stdout.write(json.dumps(result))
 
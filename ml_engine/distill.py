@@ -0,0 +1,187 @@
+import os
+import time
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from ml_engine.models.gan import ResNetEncoder, LightweightEncoder, VoxelGANGenerator
+from ml_engine.utils.dataset_loader import load_shared_dataset
+from ml_engine.utils.evaluation import evaluate, frozen_outputs
+
+def _count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+def measure_latency(encoder, generator, images, threads=1, warmup=3, max_images=50):
+    """
+    Mean single-image CPU latency (ms) with a fixed thread budget.
+    :return: (encode_ms, pipeline_ms)
+    """
+    previous_threads = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    encoder.eval()
+    generator.eval()
+    samples = images[:max_images]
+    encode_total, pipeline_total = 0.0, 0.0
+    try:
+        with torch.no_grad():
+            for i in range(warmup):
+                generator(encoder(samples[i % len(samples)].unsqueeze(0)))
+            for image in samples:
+                start = time.perf_counter()
+                latent = encoder(image.unsqueeze(0))
+                encoded = time.perf_counter()
+                generator(latent)
+                done = time.perf_counter()
+                encode_total += encoded - start
+                pipeline_total += done - start
+    finally:
+        torch.set_num_threads(previous_threads)
+    return encode_total * 1000 / len(samples), pipeline_total * 1000 / len(samples)
+
+def _encoder_row(encoder, generator, images, voxels, teacher_voxels, threads):
+    """
+    One row of the trade-off report, measured on CPU.
+    teacher_iou:  IoU against the teacher's own voxels (the headline metric)
+    seen_gt_iou:  IoU against ground truth on the held-out split; latest.pth was
+                  trained on the whole dataset, so this is agreement on seen data
+    """
+    cpu = torch.device("cpu")
+    encoder, generator = encoder.to(cpu), generator.to(cpu)
+    encode_ms, pipeline_ms = measure_latency(encoder, generator, images, threads=threads)
+    _, teacher_iou = evaluate(encoder, generator, images, teacher_voxels, cpu)
+    _, seen_gt_iou = evaluate(encoder, generator, images, voxels, cpu)
+    return {
+        "params": _count_parameters(encoder),
+        "encode_ms": round(encode_ms, 3),
+        "pipeline_ms": round(pipeline_ms, 3),
+        "requests_per_s": round(1000 / pipeline_ms, 2),
+        "teacher_iou": round(teacher_iou, 4),
+        "seen_gt_iou": round(seen_gt_iou, 4),
+    }
+
+def format_latency_report(report):
+    """
+    Plain-text latency vs. IoU table, teacher first.
+    """
+    lines = [f"{'encoder':<10}  {'params':>10}  {'encode_ms':>9}  {'pipeline_ms':>11}  {'req/s':>7}  "
+             f"{'speedup':>7}  {'teacher_iou':>11}  {'seen_gt_iou':>11}"]
+    rows = [("teacher", report["teacher"])]
+    rows += [(f"width={r['width']}", r) for r in report["students"]]
+    for name, r in rows:
+        speedup = report["teacher"]["pipeline_ms"] / r["pipeline_ms"]
+        lines.append(f"{name:<10}  {r['params']:>10}  {r['encode_ms']:>9.2f}  {r['pipeline_ms']:>11.2f}  "
+                     f"{r['requests_per_s']:>7.2f}  {speedup:>6.2f}x  {r['teacher_iou']:>11.4f}  {r['seen_gt_iou']:>11.4f}")
+    lines.append(f"Latency at {report['threads']} thread(s). seen_gt_iou uses samples the teacher was trained on.")
+    return "\n".join(lines)
+
+def _train_student(width, images, target_latents, target_voxels, generator, epochs, batch_size, lr, lambda_voxel, device):
+    """
+    Fit a LightweightEncoder of the given width to cached teacher outputs.
+    """
+    student = LightweightEncoder(width=width).to(device)
+    optimizer = optim.Adam(student.parameters(), lr=lr)
+    criterion_latent = nn.MSELoss()
+    criterion_voxel = nn.L1Loss()
+    dataloader = DataLoader(
+        TensorDataset(images, target_latents, target_voxels),
+        batch_size=batch_size, shuffle=True, num_workers=0
+    )
+
+    for epoch in range(epochs):
+        student.train()
+        total, steps = 0.0, 0
+        for batch_images, latents, voxels in dataloader:
+            batch_images, latents, voxels = batch_images.to(device), latents.to(device), voxels.to(device)
+
+            optimizer.zero_grad()
+            student_latent = student(batch_images)
+            loss = criterion_latent(student_latent, latents)
+            loss = loss + criterion_voxel(generator(student_latent), voxels) * lambda_voxel
+            loss.backward()
+            optimizer.step()
+
+            total += loss.item()
+            steps += 1
+
+        print(f"[width={width}][{epoch+1}/{epochs}] Loss_distill: {total / max(steps, 1):.4f}")
+
+    return student
+
+def distill(
+    data_dir="data",
+    teacher_path="ml_engine/weights/latest.pth",
+    save_path="ml_engine/weights/student.pth",
+    epochs=30,
+    batch_size=16,
+    lr=0.001,
+    lambda_voxel=10.0,
+    width=16,
+    compare_widths=(8, 32),
+    report_threads=1,
+    device="cuda" if torch.cuda.is_available() else "cpu"
+):
+    """
+    Train LightweightEncoders to imitate the checkpoint's ResNetEncoder.
+    The generator stays frozen; each student is fit to the teacher's latents (MSE)
+    and to the voxels the generator produces from them (L1, weighted by `lambda_voxel`).
+    The `width` student is saved to `save_path` and loads directly into ModelInferenceService;
+    `compare_widths` students are saved next to it as student_w<width>.pth for the trade-off report.
+    :return: Latency vs. IoU report for the teacher and every student width
+    """
+    if not os.path.exists(teacher_path):
+        raise FileNotFoundError(f"Teacher checkpoint not found: {teacher_path}")
+
+    print(f"Starting Distillation on {device}...")
+    checkpoint = torch.load(teacher_path, map_location=device)
+    teacher = ResNetEncoder().to(device)
+    generator = VoxelGANGenerator().to(device)
+    teacher.load_state_dict(checkpoint['encoder'])
+    generator.load_state_dict(checkpoint['generator'])
+    teacher.eval()
+    generator.eval()
+    for param in list(teacher.parameters()) + list(generator.parameters()):
+        param.requires_grad_(False)
+
+    train_images, _, val_images, val_voxels = load_shared_dataset(data_dir)
+
+    # The teacher is frozen, so its targets are computed once for every width and epoch
+    target_latents, target_voxels = frozen_outputs(teacher, generator, train_images, device)
+    _, teacher_val_voxels = frozen_outputs(teacher, generator, val_images, device)
+    print(f"Cached teacher outputs for {train_images.size(0)} samples.")
+
+    start_time = time.time()
+    students = []
+    for student_width in sorted({width, *compare_widths}):
+        student = _train_student(
+            student_width, train_images, target_latents, target_voxels, generator,
+            epochs, batch_size, lr, lambda_voxel, device
+        )
+        path = save_path if student_width == width else os.path.join(
+            os.path.dirname(save_path), f"student_w{student_width}.pth"
+        )
+        torch.save({
+            'epoch': epochs - 1,
+            'encoder_type': 'lightweight',
+            'encoder_kwargs': {'width': student_width},
+            'encoder': student.state_dict(),
+            'generator': generator.state_dict(),
+            'teacher': teacher_path,
+        }, path)
+        students.append((student_width, student, path))
+
+    print(f"Distillation finished in {time.time() - start_time:.2f}s")
+
+    report = {
+        "threads": report_threads,
+        "teacher": _encoder_row(teacher, generator, val_images, val_voxels, teacher_val_voxels, report_threads),
+        "students": [],
+    }
+    for student_width, student, path in students:
+        row = _encoder_row(student, generator, val_images, val_voxels, teacher_val_voxels, report_threads)
+        report["students"].append({"width": student_width, "checkpoint": path, **row})
+    print(format_latency_report(report))
+    return report
+
+if __name__ == "__main__":
+    # Test run
+    distill(epochs=2)
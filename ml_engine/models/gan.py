@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision import models
 from ml_engine.core.interfaces import IEncoder, IGenerator, IDiscriminator
 
@@ -26,11 +27,66 @@ class ResNetEncoder(nn.Module, IEncoder):
         x = self.projection(x)
         return x
 
+def _depthwise_separable(in_channels: int, out_channels: int, stride: int) -> nn.Sequential:
+    """
+    MobileNet-style block: 3x3 depthwise conv followed by a 1x1 pointwise conv.
+    """
+    return nn.Sequential(
+        nn.Conv2d(in_channels, in_channels, kernel_size=3, stride=stride, padding=1, groups=in_channels, bias=False),
+        nn.BatchNorm2d(in_channels),
+        nn.ReLU6(inplace=True),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1, bias=False),
+        nn.BatchNorm2d(out_channels),
+        nn.ReLU6(inplace=True),
+    )
+
+class LightweightEncoder(nn.Module, IEncoder):
+    """
+    Small CPU-friendly Encoder built from depthwise separable convolutions.
+    Trained by distillation from ResNetEncoder (see ml_engine/distill.py).
+    Encodes (3, 256, 256) -> (Latent_Dim).
+    """
+    def __init__(self, latent_dim: int = 256, width: int = 16):
+        super().__init__()
+        self.features = nn.Sequential(
+            # Input: (3, 256, 256)
+            nn.Conv2d(3, width, kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(width),
+            nn.ReLU6(inplace=True),
+            # (w, 128, 128)
+            _depthwise_separable(width, width * 2, stride=2),      # (2w, 64, 64)
+            _depthwise_separable(width * 2, width * 4, stride=2),  # (4w, 32, 32)
+            _depthwise_separable(width * 4, width * 8, stride=2),  # (8w, 16, 16)
+            _depthwise_separable(width * 8, width * 8, stride=2),  # (8w, 8, 8)
+            _depthwise_separable(width * 8, width * 16, stride=2), # (16w, 4, 4)
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.projection = nn.Linear(width * 16, latent_dim)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # x: (B, 3, 256, 256)
+        x = self.features(x)
+        x = torch.flatten(x, 1)
+        x = self.projection(x)
+        return x
+
+# Encoder implementations selectable by name (stored as 'encoder_type' in checkpoints)
+ENCODERS = {
+    "resnet18": ResNetEncoder,
+    "lightweight": LightweightEncoder,
+}
+
 class VoxelGANGenerator(nn.Module, IGenerator):
     """
     Concrete Generator using 3D Transposed Convolutions.
     Decodes (Latent_Dim) -> (1, 32, 32, 32).
     """
+    # Above this share of occupied 16³ cells decode_sparse() runs the dense layer instead
+    # (break-even measured single-threaded on CPU: sparse wins below ~25%)
+    SPARSE_MAX_OCCUPANCY = 0.25
+    # Index of the final 16³ -> 32³ layer in `decoder`; decode_coarse() stops before it
+    FINE_LAYER = 9
+
     def __init__(self, latent_dim: int = 256):
         super().__init__()
         self.latent_dim = latent_dim
@@ -60,12 +116,128 @@ class VoxelGANGenerator(nn.Module, IGenerator):
             nn.Sigmoid() # Output probability of voxel existence (0-1)
         )
 
+        # decode_sparse() rewrites the fine layer as a parity matrix, which only holds for this layout
+        fine = self.decoder[self.FINE_LAYER]
+        if not (
+            isinstance(fine, nn.ConvTranspose3d) and fine.out_channels == 1
+            and fine.kernel_size == (4, 4, 4) and fine.stride == (2, 2, 2) and fine.padding == (1, 1, 1)
+            and len(self.decoder) == self.FINE_LAYER + 2 and isinstance(self.decoder[-1], nn.Sigmoid)
+        ):
+            raise RuntimeError("decoder[FINE_LAYER:] must be ConvTranspose3d(C, 1, 4, stride 2, padding 1) + Sigmoid")
+
     def forward(self, z: torch.Tensor) -> torch.Tensor:
         x = self.fc(z)
         x = x.view(-1, 256, 2, 2, 2)
         x = self.decoder(x)
         return x
 
+    def decode_coarse(self, z: torch.Tensor) -> torch.Tensor:
+        """
+        Run every decoder block except the final 32³ layer.
+        :return: (B, 32, 16, 16, 16) Feature volume for decode_sparse()
+        """
+        x = self.fc(z).view(-1, 256, 2, 2, 2)
+        return self.decoder[:self.FINE_LAYER](x)
+
+    def decode_fine(self, features: torch.Tensor) -> torch.Tensor:
+        """
+        Run the final 32³ layer densely; decode_fine(decode_coarse(z)) equals forward(z).
+        :param features: (B, 32, 16, 16, 16) Output of decode_coarse()
+        :return: (B, 1, 32, 32, 32) Voxel grid (Probability map)
+        """
+        return self.decoder[self.FINE_LAYER:](features)
+
+    def decode_sparse(self, features: torch.Tensor, mask: torch.Tensor, max_occupancy: float = None) -> torch.Tensor:
+        """
+        Apply the final 16³ -> 32³ layer only under occupied coarse cells.
+        Each coarse cell j owns the 2x2x2 output cells 2j..2j+1, which read the
+        3x3x3 input neighbourhood around j, so its children are one row of a
+        matmul between that patch and the parity matrix of the last kernel.
+        The gather costs more per cell than the dense layer, so above `max_occupancy`
+        (default SPARSE_MAX_OCCUPANCY) the dense layer is run and masked instead.
+        Cells outside the mask are left empty (probability 0).
+        :param features: (B, 32, 16, 16, 16) Output of decode_coarse()
+        :param mask: (B, 1, 16, 16, 16) Boolean coarse occupancy
+        :return: (B, 1, 32, 32, 32) Voxel grid (Probability map)
+        """
+        if max_occupancy is None:
+            max_occupancy = self.SPARSE_MAX_OCCUPANCY
+        if mask.float().mean().item() > max_occupancy:
+            upsampled = mask.repeat_interleave(2, 2).repeat_interleave(2, 3).repeat_interleave(2, 4)
+            return self.decode_fine(features) * upsampled
+
+        final = self.decoder[self.FINE_LAYER]
+        batch, channels, size = features.size(0), features.size(1), features.size(-1)
+        children = features.new_zeros(batch * size ** 3, 8)
+
+        cells = mask.reshape(-1).nonzero().squeeze(1)  # Flat (b, z, y, x) indices
+        if cells.numel() > 0:
+            # Channels-last rows of the padded volume, so each patch voxel is one contiguous row
+            padded_size = size + 2
+            rows = F.pad(features, (1, 1, 1, 1, 1, 1)).permute(0, 2, 3, 4, 1).reshape(-1, channels)
+            b, rem = cells // size ** 3, cells % size ** 3
+            z, y, x = rem // size ** 2, (rem // size) % size, rem % size
+            # +1 padding shift cancels the -1 neighbourhood offset
+            corner = ((b * padded_size + z) * padded_size + y) * padded_size + x
+            patches = rows.index_select(0, (corner[:, None] + self._patch_offsets(padded_size, cells.device)).reshape(-1))
+            logits = torch.addmm(final.bias, patches.view(-1, 27 * channels), self._parity())
+            children[cells] = torch.sigmoid(logits)
+
+        # (B, z, y, x, a, b, c) -> (B, 1, 2z + a, 2y + b, 2x + c)
+        children = children.view(batch, size, size, size, 2, 2, 2)
+        return children.permute(0, 1, 4, 2, 5, 3, 6).reshape(batch, 1, size * 2, size * 2, size * 2)
+
+    @staticmethod
+    def _patch_offsets(padded_size: int, device) -> torch.Tensor:
+        # Flat offsets of the 3x3x3 neighbourhood, ordered (z, y, x) like the parity matrix rows
+        o = torch.arange(3, device=device)
+        return ((o.view(3, 1, 1) * padded_size + o.view(1, 3, 1)) * padded_size + o.view(1, 1, 3)).view(1, 27)
+
+    def _parity(self) -> torch.Tensor:
+        """
+        Parity matrix of the final layer, rebuilt only when its weight changes
+        (load_state_dict, an optimizer step or a device move).
+        """
+        weight = self.decoder[self.FINE_LAYER].weight
+        key = (weight.data_ptr(), weight._version)
+        if getattr(self, "_parity_key", None) != key:
+            with torch.no_grad():
+                self._parity_cache = _parity_matrix(weight)
+            self._parity_key = key
+        return self._parity_cache
+
+# For ConvTranspose3d(kernel=4, stride=2, padding=1): output 2j + parity reads
+# input j - 1 + patch_offset through kernel tap k, as (parity, patch_offset, k)
+_PARITY_TAPS = ((0, 0, 3), (0, 1, 1), (1, 1, 2), (1, 2, 0))
+
+def _parity_matrix(weight: torch.Tensor) -> torch.Tensor:
+    """
+    Rewrite a (C_in, 1, 4, 4, 4) transposed-conv kernel as a (27 * C_in, 8) matrix
+    mapping a 3x3x3 input patch (patch voxel major, channel minor) to the 2x2x2
+    output cells of its centre.
+    """
+    channels = weight.size(0)
+    matrix = weight.new_zeros(3, 3, 3, channels, 2, 2, 2)
+    for a, pz, kz in _PARITY_TAPS:
+        for b, py, ky in _PARITY_TAPS:
+            for c, px, kx in _PARITY_TAPS:
+                matrix[pz, py, px, :, a, b, c] = weight[:, 0, kz, ky, kx]
+    return matrix.view(27 * channels, 8)
+
+class OccupancyHead(nn.Module):
+    """
+    Lightweight 1x1x1 head predicting 16³ occupancy from the generator's
+    coarse feature volume (see VoxelGANGenerator.decode_coarse).
+    Trained separately so existing checkpoints stay loadable (see ml_engine/progressive.py).
+    """
+    def __init__(self, channels: int = 32):
+        super().__init__()
+        self.head = nn.Conv3d(channels, 1, kernel_size=1)
+
+    def forward(self, features: torch.Tensor) -> torch.Tensor:
+        # features: (B, 32, 16, 16, 16) -> (B, 1, 16, 16, 16) occupancy probability
+        return torch.sigmoid(self.head(features))
+
 class VoxelDiscriminator(nn.Module, IDiscriminator):
     """
     Concrete Discriminator using 3D CNN.
@@ -0,0 +1,152 @@
+import os
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from ml_engine.models.gan import ENCODERS, VoxelGANGenerator, OccupancyHead
+from ml_engine.utils.dataset_loader import load_shared_dataset
+from ml_engine.utils.evaluation import frozen_outputs
+
+def coarse_targets(voxels, threshold=0.5, resolution=16):
+    """
+    A coarse cell is occupied if any fine voxel inside it is occupied,
+    which is exactly the condition for refining it.
+    :param voxels: (B, 1, 32, 32, 32) Probability map
+    :return: (B, 1, R, R, R) Binary occupancy
+    """
+    return F.max_pool3d((voxels > threshold).float(), kernel_size=voxels.size(-1) // resolution)
+
+def _synchronize(tensor):
+    # CUDA kernels run asynchronously; wait for them so wall times are real
+    if tensor.is_cuda:
+        torch.cuda.synchronize()
+
+def progressive_report(generator, head, latents, voxels, coarse_threshold=0.3):
+    """
+    How well and how fast sparse refinement reproduces the dense output on held-out latents.
+    Each sample is decoded on its own, as in serving.
+    recall:          share of dense occupied voxels whose 16³ parent was refined
+    refined_ratio:   share of 16³ cells refined (the rest of the final layer is skipped)
+    dense_fallback:  share of samples above SPARSE_MAX_OCCUPANCY, run densely and masked
+    dense_iou:       IoU between sparse and dense 32³ grids
+    sparse_ms:       mean wall time of decode_sparse() for the final layer
+    dense_ms:        mean wall time of decode_fine(), the dense layer it replaces
+    """
+    hits, occupied, refined, cells, intersection, union = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+    fallbacks, sparse_time, dense_time = 0, 0.0, 0.0
+    with torch.no_grad():
+        for i in range(latents.size(0)):
+            features = generator.decode_coarse(latents[i:i + 1])
+            mask = head(features) >= coarse_threshold
+            dense = voxels[i:i + 1] > 0.5
+
+            start = time.perf_counter()
+            sparse = generator.decode_sparse(features, mask)
+            _synchronize(features)
+            sparse_time += time.perf_counter() - start
+            start = time.perf_counter()
+            generator.decode_fine(features)
+            _synchronize(features)
+            dense_time += time.perf_counter() - start
+
+            sparse = sparse > 0.5
+            covered = mask.repeat_interleave(2, 2).repeat_interleave(2, 3).repeat_interleave(2, 4)
+            hits += (dense & covered).sum().item()
+            occupied += dense.sum().item()
+            refined += mask.sum().item()
+            cells += mask.numel()
+            fallbacks += int(mask.float().mean().item() > generator.SPARSE_MAX_OCCUPANCY)
+            intersection += (sparse & dense).sum().item()
+            union += (sparse | dense).sum().item()
+    n = max(latents.size(0), 1)
+    return {
+        "coarse_threshold": coarse_threshold,
+        "recall": round(hits / occupied if occupied else 1.0, 4),
+        "refined_ratio": round(refined / cells, 4),
+        "dense_fallback": round(fallbacks / n, 4),
+        "dense_iou": round(intersection / union if union else 1.0, 4),
+        "sparse_ms": round(sparse_time * 1000 / n, 3),
+        "dense_ms": round(dense_time * 1000 / n, 3),
+    }
+
+def train_occupancy_head(
+    data_dir="data",
+    checkpoint_path="ml_engine/weights/latest.pth",
+    save_path="ml_engine/weights/occupancy_head.pth",
+    epochs=10,
+    batch_size=32,
+    lr=0.001,
+    coarse_threshold=0.3,
+    device="cuda" if torch.cuda.is_available() else "cpu"
+):
+    """
+    Fit an OccupancyHead on top of a frozen checkpoint.
+    Targets are the checkpoint's own 32³ output max-pooled to 16³,
+    so the head learns where the generator will place voxels.
+    The head must be retrained whenever the checkpoint changes.
+    :return: Sparse-vs-dense report on the validation split (see progressive_report)
+    """
+    if not os.path.exists(checkpoint_path):
+        raise FileNotFoundError(f"Checkpoint not found: {checkpoint_path}")
+
+    print(f"Starting Occupancy Head Training on {device}...")
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    encoder = ENCODERS[checkpoint.get('encoder_type', 'resnet18')](**checkpoint.get('encoder_kwargs', {})).to(device)
+    generator = VoxelGANGenerator().to(device)
+    encoder.load_state_dict(checkpoint['encoder'])
+    generator.load_state_dict(checkpoint['generator'])
+    encoder.eval()
+    generator.eval()
+    for param in list(encoder.parameters()) + list(generator.parameters()):
+        param.requires_grad_(False)
+
+    train_images, _, val_images, _ = load_shared_dataset(data_dir)
+    # Encoder and generator are frozen, so latents and targets are computed once
+    latents, voxels = frozen_outputs(encoder, generator, train_images, device)
+    val_latents, val_voxels = frozen_outputs(encoder, generator, val_images, device)
+    print(f"Cached latents for {latents.size(0)} samples.")
+
+    head = OccupancyHead().to(device)
+    optimizer = optim.Adam(head.parameters(), lr=lr)
+    criterion = nn.BCELoss()
+    dataloader = DataLoader(TensorDataset(latents, voxels), batch_size=batch_size, shuffle=True, num_workers=0)
+
+    start_time = time.time()
+    for epoch in range(epochs):
+        head.train()
+        total, steps = 0.0, 0
+        for z, fine in dataloader:
+            z, fine = z.to(device), fine.to(device)
+            with torch.no_grad():
+                features = generator.decode_coarse(z)
+
+            optimizer.zero_grad()
+            loss = criterion(head(features), coarse_targets(fine))
+            loss.backward()
+            optimizer.step()
+
+            total += loss.item()
+            steps += 1
+
+        print(f"[{epoch+1}/{epochs}] Loss_occupancy: {total / max(steps, 1):.4f}")
+
+        torch.save({
+            'epoch': epoch,
+            'head': head.state_dict(),
+            'checkpoint': checkpoint_path,
+        }, save_path)
+
+    print(f"Occupancy head training finished in {time.time() - start_time:.2f}s")
+
+    head.eval()
+    report = progressive_report(generator, head, val_latents.to(device), val_voxels.to(device), coarse_threshold)
+    print(f"Recall {report['recall']:.4f}, refined {report['refined_ratio']:.2%} of 16³ cells "
+          f"({report['dense_fallback']:.0%} of samples fell back to dense), IoU vs dense {report['dense_iou']:.4f}, "
+          f"final layer {report['sparse_ms']:.2f}ms sparse vs {report['dense_ms']:.2f}ms dense")
+    return report
+
+if __name__ == "__main__":
+    # Test run
+    train_occupancy_head(epochs=2)
@@ -1,62 +1,185 @@
 
 import torch
 import os
-import time
+import sys
+import numpy as np
+from PIL import Image
+from torchvision import transforms
 from ml_engine.core.interfaces import IEncoder, IGenerator
-from ml_engine.models.gan import ResNetEncoder, VoxelGANGenerator
+from ml_engine.models.gan import ENCODERS, VoxelGANGenerator, OccupancyHead
+from ml_engine.utils.profiling import InferenceProfiler
 
 class ModelInferenceService:
     """
     Service to handle the full pipeline: Image -> Encoder -> Latent -> Generator -> 3D Voxel.
     """
-    def __init__(self, weights_path: str = None, device: str = "cpu"):
+    def __init__(
+        self,
+        weights_path: str = None,
+        device: str = "cpu",
+        profiler: InferenceProfiler = None,
+        encoder_type: str = "resnet18",
+        head_path: str = None
+    ):
         self.device = torch.device(device)
         self.latent_dim = 256
+        self.profiler = profiler or InferenceProfiler()
+        
+        # Preprocessing must match the training transform in VoxelDataset
+        self.transform = transforms.Compose([
+            transforms.Resize((256, 256)),
+            transforms.ToTensor(),
+        ])
         
         # Initialize models
-        self.encoder: IEncoder = ResNetEncoder(latent_dim=self.latent_dim).to(self.device)
+        self.encoder: IEncoder = None
+        self.encoder_type, self.encoder_kwargs = None, None
         self.generator: IGenerator = VoxelGANGenerator(latent_dim=self.latent_dim).to(self.device)
-        
-        self.encoder.eval()
         self.generator.eval()
+        self.profiler.watch("generator", self.generator)
 
+        # The checkpoint names its encoder class; `encoder_type` only applies without one
         if weights_path and os.path.exists(weights_path):
             self.load_weights(weights_path)
+        if self.encoder is None:
+            self._build_encoder(encoder_type)
+        
+        # Optional coarse occupancy head for progressive generation
+        self.occupancy_head = None
+        if head_path and os.path.exists(head_path):
+            self.load_occupancy_head(head_path)
+    
+    def _build_encoder(self, encoder_type: str, encoder_kwargs: dict = None):
+        if encoder_type not in ENCODERS:
+            raise ValueError(f"Unknown encoder type: {encoder_type}")
+        self.encoder_type = encoder_type
+        self.encoder_kwargs = encoder_kwargs or {}
+        self.encoder = ENCODERS[encoder_type](latent_dim=self.latent_dim, **self.encoder_kwargs).to(self.device)
+        self.encoder.eval()
+        self.profiler.watch("encoder", self.encoder)
     
     def load_weights(self, path: str):
         """
         Load pretrained weights for both encoder and generator.
         Expects a dict: {'encoder': state_dict, 'generator': state_dict}
+        Optional 'encoder_type' (e.g. 'lightweight' for distilled students) and
+        'encoder_kwargs' (e.g. {'width': 8}) select and configure the encoder class.
         """
         checkpoint = torch.load(path, map_location=self.device)
+        encoder_type = checkpoint.get('encoder_type', 'resnet18')
+        encoder_kwargs = checkpoint.get('encoder_kwargs', {})
+        if self.encoder is None or encoder_type != self.encoder_type or encoder_kwargs != self.encoder_kwargs:
+            self._build_encoder(encoder_type, encoder_kwargs)
         self.encoder.load_state_dict(checkpoint['encoder'])
         self.generator.load_state_dict(checkpoint['generator'])
-        import sys
         sys.stderr.write(f"Weights loaded from {path}\n")
 
+    def load_occupancy_head(self, path: str):
+        """
+        Load an OccupancyHead trained for the current weights (see ml_engine/progressive.py).
+        Expects a dict: {'head': state_dict}
+        """
+        checkpoint = torch.load(path, map_location=self.device)
+        self.occupancy_head = OccupancyHead().to(self.device)
+        self.occupancy_head.load_state_dict(checkpoint['head'])
+        self.occupancy_head.eval()
+        sys.stderr.write(f"Occupancy head loaded from {path}\n")
+
+    def preprocess(self, image: Image.Image) -> torch.Tensor:
+        """
+        Convert a PIL image into a batched tensor on the service device.
+        Host-to-device copy is included in the 'preprocess' stage.
+        :return: (1, 3, 256, 256) Image tensor
+        """
+        with self.profiler.stage("preprocess"):
+            return self.transform(image.convert('RGB')).unsqueeze(0).to(self.device)
+
     def generate_from_image(self, image_tensor: torch.Tensor) -> torch.Tensor:
         """
         Run the generation pipeline.
         :param image_tensor: (1, 3, 256, 256) Normalized image
         :return: (1, 32, 32, 32) Voxel grid (Probability map)
         """
-        start_time = time.time()
-        
         with torch.no_grad():
             image_tensor = image_tensor.to(self.device)
             
             # 1. Encode image to latent vector
-            latent_vector = self.encoder(image_tensor)
+            with self.profiler.stage("encode"):
+                latent_vector = self.encoder(image_tensor)
             
             # 2. Generate voxels from latent vector
-            voxels = self.generator(latent_vector)
+            with self.profiler.stage("decode"):
+                voxels = self.generator(latent_vector)
             
-            # 3. Thresholding (Optional)
-            # voxels = (voxels > 0.5).float()
-            
-            end_time = time.time()
-            duration_ms = (end_time - start_time) * 1000
-            import sys
-            sys.stderr.write(f"[Inference] Generated voxel grid in {duration_ms:.2f}ms\n")
+            timings = self.profiler.last_request
+            sys.stderr.write(
+                f"[Inference] Generated voxel grid in {timings['encode'] + timings['decode']:.2f}ms "
+                f"(encode {timings['encode']:.2f}ms, decode {timings['decode']:.2f}ms)\n"
+            )
             
             return voxels
+
+    @torch.no_grad()
+    def generate_progressive(self, image_tensor: torch.Tensor, coarse_threshold: float = 0.3, level: float = 0.5):
+        """
+        Coarse-to-fine generation pipeline, yielding JSON-ready messages.
+        A 16³ 'preview' message is yielded as soon as the occupancy head has run.
+        It lists the coarse cells with occupancy >= `coarse_threshold`, which is the
+        same mask that selects the cells refined next. Then the 32³ 'success'
+        message follows, thresholded at `level` like generate_from_image().
+        :param image_tensor: (1, 3, 256, 256) Normalized image
+        """
+        if self.occupancy_head is None:
+            raise RuntimeError("Progressive mode needs an occupancy head, run --train-head first")
+        
+        image_tensor = image_tensor.to(self.device)
+        
+        # 1. Encode image to latent vector
+        with self.profiler.stage("encode"):
+            latent_vector = self.encoder(image_tensor)
+        
+        # 2. Decode up to the 16³ feature volume
+        with self.profiler.stage("decode_coarse"):
+            features = self.generator.decode_coarse(latent_vector)
+        
+        # 3. Coarse occupancy preview
+        with self.profiler.stage("preview"):
+            mask = self.occupancy_head(features) >= coarse_threshold
+            preview = self._to_message(mask.int().squeeze().cpu().numpy(), status="preview")
+            preview["coarse_threshold"] = coarse_threshold
+        yield preview
+        
+        # 4. Refine only the occupied coarse cells to 32³
+        with self.profiler.stage("refine"):
+            voxels = self.generator.decode_sparse(features, mask)
+        
+        result = self.serialize(self.threshold(voxels, level))
+        result["refined_cells"] = int(mask.sum().item())
+        result["coarse_cells"] = mask.numel()
+        yield result
+
+    def threshold(self, voxels: torch.Tensor, level: float = 0.5) -> np.ndarray:
+        """
+        Binarize the probability map.
+        :return: (32, 32, 32) int array of occupied cells
+        """
+        with self.profiler.stage("threshold"):
+            return (voxels > level).int().squeeze().cpu().numpy()
+
+    def serialize(self, active_voxels: np.ndarray) -> dict:
+        """
+        Build the JSON-ready result with a sparse list of active voxels.
+        """
+        with self.profiler.stage("serialize"):
+            return self._to_message(active_voxels)
+
+    @staticmethod
+    def _to_message(active_voxels: np.ndarray, status: str = "success") -> dict:
+        # Get coordinates of active voxels
+        coords = np.argwhere(active_voxels == 1).tolist()
+        return {
+            "status": status,
+            "model_shape": list(active_voxels.shape),
+            "voxel_count": len(coords),
+            "voxels": coords # List of [z, y, x]
+        }
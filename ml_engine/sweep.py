@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import itertools
+import torch
+import torch.multiprocessing as mp
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from ml_engine.models.gan import ResNetEncoder, VoxelGANGenerator, VoxelDiscriminator
+from ml_engine.train import weights_init, train_epoch
+from ml_engine.utils.dataset_loader import load_shared_dataset
+from ml_engine.utils.evaluation import evaluate
+
+# Hyperparameters a sweep may vary, with the same defaults as train()
+DEFAULTS = {
+    "lr": 0.0002,
+    "beta1": 0.5,
+    "batch_size": 8,
+    "lambda_l1": 100.0,
+}
+
+# Filled in each worker process by _init_worker
+_shared = {}
+
+def _sample_value(rng, name, domain):
+    """
+    Draw one value for random search.
+    A list is sampled uniformly; a dict {"min", "max", "log"} is a continuous range.
+    """
+    if isinstance(domain, list):
+        return rng.choice(domain)
+    low, high = domain["min"], domain["max"]
+    if domain.get("log", False):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if name == "batch_size" else value
+
+def expand_spec(spec):
+    """
+    Turn a sweep spec into a list of trial configs.
+    Grid: every combination of the listed values.
+    Random: `num_trials` draws from the given lists/ranges.
+    """
+    params = spec.get("params", {})
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+
+    method = spec.get("method", "grid")
+    if method == "grid":
+        names = list(params)
+        for name in names:
+            if not isinstance(params[name], list):
+                raise ValueError(f"Grid search needs a list of values for '{name}'")
+        combos = itertools.product(*(params[name] for name in names))
+        configs = [dict(zip(names, values)) for values in combos]
+    elif method == "random":
+        rng = random.Random(spec.get("seed", 0))
+        configs = [
+            {name: _sample_value(rng, name, domain) for name, domain in params.items()}
+            for _ in range(spec.get("num_trials", 10))
+        ]
+    else:
+        raise ValueError(f"Unknown sweep method: {method}")
+    if not configs:
+        raise ValueError("Sweep spec expands to no trials")
+
+    return [{**DEFAULTS, **config} for config in configs]
+
+def halving_budgets(min_epochs, max_epochs, eta):
+    """
+    Epoch budgets for each successive-halving rung, e.g. (1, 9, 3) -> [1, 3, 9].
+    Requires integers with eta >= 2 and 1 <= min_epochs <= max_epochs.
+    """
+    for name, value in (("min_epochs", min_epochs), ("max_epochs", max_epochs), ("eta", eta)):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{name} must be an integer, got {value!r}")
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2, got {eta}")
+    if not 1 <= min_epochs <= max_epochs:
+        raise ValueError(f"Need 1 <= min_epochs <= max_epochs, got {min_epochs} and {max_epochs}")
+    budgets = []
+    budget = min_epochs
+    while budget < max_epochs:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_epochs)
+    return budgets
+
+def _init_worker(train_images, train_voxels, val_images, val_voxels, threads):
+    # Keep trial output away from the JSON written on the real stdout
+    sys.stdout = sys.stderr
+    torch.set_num_threads(threads)
+    _shared.update(
+        train=TensorDataset(train_images, train_voxels),
+        val_images=val_images,
+        val_voxels=val_voxels,
+    )
+
+def _run_trial(job):
+    """
+    Train one trial up to `job['epochs']`, continuing from its checkpoint if a previous rung saved one.
+    On the last rung only the encoder and generator are kept, so the checkpoint
+    is small and loads straight into ModelInferenceService.
+    """
+    trial_id, config, epochs, checkpoint_path, device, seed, final = (
+        job["trial_id"], job["config"], job["epochs"], job["checkpoint"], job["device"], job["seed"], job["final"]
+    )
+    torch.manual_seed(seed + trial_id)
+    started = time.time()
+
+    encoder = ResNetEncoder().to(device)
+    generator = VoxelGANGenerator().to(device)
+    discriminator = VoxelDiscriminator().to(device)
+    betas = (config["beta1"], 0.999)
+    optimizerG = optim.Adam(list(generator.parameters()) + list(encoder.parameters()), lr=config["lr"], betas=betas)
+    optimizerD = optim.Adam(discriminator.parameters(), lr=config["lr"], betas=betas)
+
+    start_epoch = 0
+    if os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        encoder.load_state_dict(checkpoint['encoder'])
+        generator.load_state_dict(checkpoint['generator'])
+        discriminator.load_state_dict(checkpoint['discriminator'])
+        optimizerG.load_state_dict(checkpoint['optimizerG'])
+        optimizerD.load_state_dict(checkpoint['optimizerD'])
+        start_epoch = checkpoint['epoch'] + 1
+    else:
+        generator.apply(weights_init)
+        discriminator.apply(weights_init)
+
+    dataloader = DataLoader(_shared["train"], batch_size=config["batch_size"], shuffle=True, num_workers=0)
+    loss_g = None
+    for epoch in range(start_epoch, epochs):
+        _, loss_g = train_epoch(
+            encoder, generator, discriminator, optimizerG, optimizerD,
+            dataloader, device, lambda_l1=config["lambda_l1"]
+        )
+
+    val_l1, val_iou = evaluate(encoder, generator, _shared["val_images"], _shared["val_voxels"], device)
+
+    state = {
+        'epoch': epochs - 1,
+        'encoder': encoder.state_dict(),
+        'generator': generator.state_dict(),
+        'config': config,
+    }
+    if not final:
+        # Full training state is only needed to resume on the next rung
+        state.update(
+            discriminator=discriminator.state_dict(),
+            optimizerG=optimizerG.state_dict(),
+            optimizerD=optimizerD.state_dict(),
+        )
+    torch.save(state, checkpoint_path)
+
+    return {
+        "trial_id": trial_id,
+        "epochs": epochs,
+        "loss_g": loss_g,
+        "val_l1": val_l1,
+        "val_iou": val_iou,
+        "seconds": time.time() - started,
+    }
+
+def format_results_table(results):
+    """
+    Plain-text table of all trials, best first.
+    """
+    columns = ["trial", "lr", "beta1", "batch_size", "lambda_l1", "epochs", "val_l1", "val_iou", "status"]
+    rows = [[
+        str(r["trial_id"]),
+        f"{r['config']['lr']:.2e}",
+        f"{r['config']['beta1']:.3f}",
+        str(r["config"]["batch_size"]),
+        f"{r['config']['lambda_l1']:.1f}",
+        str(r["epochs"]),
+        f"{r['val_l1']:.4f}",
+        f"{r['val_iou']:.4f}",
+        r["status"],
+    ] for r in results]
+    widths = [max(len(col), *(len(row[i]) for row in rows)) for i, col in enumerate(columns)]
+    lines = ["  ".join(col.ljust(w) for col, w in zip(columns, widths))]
+    lines.append("  ".join("-" * w for w in widths))
+    lines += ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+def run_sweep(spec, data_dir="data", save_dir="ml_engine/sweeps", device="cpu"):
+    """
+    Run a hyperparameter sweep with successive halving.
+
+    Spec keys:
+      method            "grid" or "random"
+      params            {name: [values]} or, for random, {name: {"min", "max", "log"}}
+      num_trials        number of random draws (random search only)
+      min_epochs        budget of the first rung (default 1)
+      max_epochs        budget of the last rung (default 9)
+      eta               keep the top 1/eta trials at each rung (default 3)
+      threads_per_trial torch threads given to each trial (default 1)
+      max_concurrent    trials run at once (default cpu_count // threads_per_trial)
+      val_fraction      share of samples held out for ranking (default 0.1)
+      seed              seed for the split, random search and trial init (default 0)
+
+    Trials are ranked by validation IoU.
+    :return: List of result dicts, best first
+    """
+    configs = expand_spec(spec)
+    seed = spec.get("seed", 0)
+    eta = spec.get("eta", 3)
+    # Validated before any data is decoded
+    budgets = halving_budgets(spec.get("min_epochs", 1), spec.get("max_epochs", 9), eta)
+    threads = spec.get("threads_per_trial", 1)
+    workers = spec.get("max_concurrent") or max(1, (os.cpu_count() or 1) // threads)
+    workers = min(workers, len(configs))
+
+    sweep_dir = os.path.join(save_dir, time.strftime("sweep_%Y%m%d_%H%M%S"))
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    print(f"Sweep: {len(configs)} trials, rungs {budgets}, {workers} workers x {threads} threads")
+    shared = load_shared_dataset(data_dir, spec.get("val_fraction", 0.1), seed)
+    print(f"Decoded {shared[0].size(0)} train / {shared[2].size(0)} val samples into shared memory.")
+
+    # Warm the torchvision weight cache once so workers don't race on the download
+    ResNetEncoder()
+
+    results = {
+        trial_id: {"trial_id": trial_id, "config": config, "status": "running"}
+        for trial_id, config in enumerate(configs)
+    }
+    alive = list(results)
+
+    def checkpoint_path(trial_id):
+        return os.path.join(sweep_dir, f"trial_{trial_id:03d}.pth")
+
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=workers, initializer=_init_worker, initargs=(*shared, threads)) as pool:
+        for rung, budget in enumerate(budgets):
+            jobs = [{
+                "trial_id": trial_id,
+                "config": results[trial_id]["config"],
+                "epochs": budget,
+                "checkpoint": checkpoint_path(trial_id),
+                "device": device,
+                "seed": seed,
+                "final": rung == len(budgets) - 1,
+            } for trial_id in alive]
+
+            for outcome in pool.imap_unordered(_run_trial, jobs):
+                results[outcome["trial_id"]].update(outcome)
+                print(f"[rung {rung}] trial {outcome['trial_id']} @ {budget} epochs: "
+                      f"val_iou {outcome['val_iou']:.4f}, val_l1 {outcome['val_l1']:.4f} "
+                      f"({outcome['seconds']:.1f}s)")
+
+            alive.sort(key=lambda trial_id: results[trial_id]["val_iou"], reverse=True)
+            if rung < len(budgets) - 1:
+                keep = max(1, math.ceil(len(alive) / eta))
+                for trial_id in alive[keep:]:
+                    results[trial_id]["status"] = f"pruned@{budget}"
+                    os.remove(checkpoint_path(trial_id))
+                alive = alive[:keep]
+
+    for trial_id in alive:
+        results[trial_id]["status"] = "completed"
+
+    ranked = sorted(results.values(), key=lambda r: (r["epochs"], r["val_iou"]), reverse=True)
+    for r in ranked:
+        r["checkpoint"] = checkpoint_path(r["trial_id"]) if r["status"] == "completed" else None
+
+    with open(os.path.join(sweep_dir, "results.json"), "w") as f:
+        json.dump({"spec": spec, "budgets": budgets, "results": ranked}, f, indent=2)
+    print(format_results_table(ranked))
+
+    return ranked
+
+if __name__ == "__main__":
+    # Usage: python ml_engine/sweep.py spec.json
+    with open(sys.argv[1]) as f:
+        run_sweep(json.load(f))
@@ -16,12 +16,81 @@ def weights_init(m):
         nn.init.normal_(m.weight.data, 1.0, 0.02)
         nn.init.constant_(m.bias.data, 0)
 
+def train_epoch(
+    encoder,
+    generator,
+    discriminator,
+    optimizerG,
+    optimizerD,
+    dataloader,
+    device,
+    lambda_l1=100.0,
+    log_prefix=None
+):
+    """
+    Run one pass over `dataloader` with the standard GAN + L1 steps.
+    Shared by `train()` and the hyperparameter sweep.
+    :return: (mean Loss_D, mean Loss_G) over the epoch
+    """
+    criterion_gan = nn.BCELoss()
+    criterion_l1 = nn.L1Loss()
+    total_d, total_g, steps = 0.0, 0.0, 0
+    
+    for i, (images, real_voxels) in enumerate(dataloader):
+        bs = images.size(0)
+        
+        real_voxels = real_voxels.to(device)
+        images = images.to(device)
+        
+        #Labels
+        real_label = torch.ones(bs, 1, device=device)
+        fake_label = torch.zeros(bs, 1, device=device)
+        
+        # ---------------------
+        #  Train Discriminator
+        # ---------------------
+        optimizerD.zero_grad()
+        output_real = discriminator(real_voxels)
+        errD_real = criterion_gan(output_real, real_label)
+        
+        latent = encoder(images)
+        fake_voxels = generator(latent)
+        output_fake = discriminator(fake_voxels.detach())
+        errD_fake = criterion_gan(output_fake, fake_label)
+        errD = (errD_real + errD_fake) / 2
+        errD.backward()
+        optimizerD.step()
+        
+        # -----------------
+        #  Train Generator
+        # -----------------
+        optimizerG.zero_grad()
+        output_fake_for_G = discriminator(fake_voxels)
+        errG_gan = criterion_gan(output_fake_for_G, real_label)
+        errG_l1 = criterion_l1(fake_voxels, real_voxels) * lambda_l1
+        errG = errG_gan + errG_l1
+        errG.backward()
+        optimizerG.step()
+        
+        total_d += errD.item()
+        total_g += errG.item()
+        steps += 1
+        
+        if log_prefix is not None and i % 10 == 0:
+            print(f"{log_prefix}[{i}/{len(dataloader)}] "
+                  f"Loss_D: {errD.item():.4f} "
+                  f"Loss_G: {errG.item():.4f}")
+    
+    steps = max(steps, 1)
+    return total_d / steps, total_g / steps
+
 def train(
     data_dir="data",
     epochs=10,
     batch_size=8,
     lr=0.0002,
     beta1=0.5,
+    lambda_l1=100.0,
     save_dir="ml_engine/weights",
     resume=True, # Auto-resume by default
     device="cuda" if torch.cuda.is_available() else "cpu"
@@ -68,15 +137,9 @@ def train(
         generator.apply(weights_init)
         discriminator.apply(weights_init)
     
-    # 4. Loss Functions
-    criterion_gan = nn.BCELoss()
-    criterion_l1 = nn.L1Loss() 
-    
-    lambda_l1 = 100.0 
-
     print(f"Loaded {len(dataset)} samples.")
 
-    # 5. Training Loop
+    # 4. Training Loop
     start_time = time.time()
     
     # Allow extending training: run 'epochs' MORE epochs, or run UNTIL 'epochs'?
@@ -90,49 +153,10 @@ def train(
         return
 
     for epoch in range(start_epoch, end_epoch):
-        for i, (images, real_voxels) in enumerate(dataloader):
-            bs = images.size(0)
-            
-            real_voxels = real_voxels.to(device)
-            images = images.to(device)
-            
-            #Labels
-            real_label = torch.ones(bs, 1, device=device)
-            fake_label = torch.zeros(bs, 1, device=device)
-            
-            # ... (Standard training steps same as before) ...
-            
-            # Match original indentation/logic for steps
-            # ---------------------
-            #  Train Discriminator
-            # ---------------------
-            optimizerD.zero_grad()
-            output_real = discriminator(real_voxels)
-            errD_real = criterion_gan(output_real, real_label)
-            
-            latent = encoder(images)
-            fake_voxels = generator(latent)
-            output_fake = discriminator(fake_voxels.detach())
-            errD_fake = criterion_gan(output_fake, fake_label)
-            errD = (errD_real + errD_fake) / 2
-            errD.backward()
-            optimizerD.step()
-            
-            # -----------------
-            #  Train Generator
-            # -----------------
-            optimizerG.zero_grad()
-            output_fake_for_G = discriminator(fake_voxels)
-            errG_gan = criterion_gan(output_fake_for_G, real_label)
-            errG_l1 = criterion_l1(fake_voxels, real_voxels) * lambda_l1
-            errG = errG_gan + errG_l1
-            errG.backward()
-            optimizerG.step()
-            
-            if i % 10 == 0:
-                print(f"[{epoch+1}/{end_epoch}][{i}/{len(dataloader)}] "
-                      f"Loss_D: {errD.item():.4f} "
-                      f"Loss_G: {errG.item():.4f}")
+        train_epoch(
+            encoder, generator, discriminator, optimizerG, optimizerD,
+            dataloader, device, lambda_l1=lambda_l1, log_prefix=f"[{epoch+1}/{end_epoch}]"
+        )
                       
         # Save Checkpoint with full state
         state = {
@@ -49,3 +49,24 @@ class VoxelDataset(Dataset):
         voxel_tensor = torch.from_numpy(voxels).unsqueeze(0)
         
         return image, voxel_tensor
+
+def load_shared_dataset(data_dir="data", val_fraction=0.1, seed=0):
+    """
+    Decode the whole dataset once and place it in shared memory.
+    Worker processes receive handles to the same storage instead of re-reading PNG/NPY files.
+    :return: (train_images, train_voxels, val_images, val_voxels)
+    """
+    dataset = VoxelDataset(data_dir=data_dir)
+    samples = [dataset[i] for i in range(len(dataset))]
+    images = torch.stack([image for image, _ in samples])
+    voxels = torch.stack([vox for _, vox in samples])
+
+    # Fixed shuffle so sweeps, distillation and head training share one validation split
+    order = torch.randperm(len(samples), generator=torch.Generator().manual_seed(seed))
+    images, voxels = images[order], voxels[order]
+    images.share_memory_()
+    voxels.share_memory_()
+
+    n_val = max(1, int(len(samples) * val_fraction))
+    n_train = len(samples) - n_val
+    return images[:n_train], voxels[:n_train], images[n_train:], voxels[n_train:]
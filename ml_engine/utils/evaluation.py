@@ -0,0 +1,36 @@
+import torch
+
+def evaluate(encoder, generator, images, voxels, device, batch_size=16):
+    """
+    Validation L1 and IoU (voxels thresholded at 0.5).
+    The models' train/eval modes are restored afterwards.
+    """
+    modes = (encoder.training, generator.training)
+    encoder.eval()
+    generator.eval()
+    total_l1, intersection, union = 0.0, 0.0, 0.0
+    with torch.no_grad():
+        for start in range(0, images.size(0), batch_size):
+            batch_images = images[start:start + batch_size].to(device)
+            real = voxels[start:start + batch_size].to(device)
+            fake = generator(encoder(batch_images))
+            total_l1 += torch.abs(fake - real).sum().item()
+            pred, target = fake > 0.5, real > 0.5
+            intersection += (pred & target).sum().item()
+            union += (pred | target).sum().item()
+    encoder.train(modes[0])
+    generator.train(modes[1])
+    return total_l1 / voxels.numel(), (intersection / union if union else 1.0)
+
+def frozen_outputs(encoder, generator, images, device, batch_size=32):
+    """
+    Run a frozen encoder + generator once over all images.
+    :return: (latents (N, Latent_Dim), voxels (N, 1, 32, 32, 32)) on CPU
+    """
+    latents, voxels = [], []
+    with torch.no_grad():
+        for start in range(0, images.size(0), batch_size):
+            latent = encoder(images[start:start + batch_size].to(device))
+            latents.append(latent.cpu())
+            voxels.append(generator(latent).cpu())
+    return torch.cat(latents), torch.cat(voxels)
@@ -0,0 +1,223 @@
+import os
+import json
+import math
+import time
+import random
+from collections import deque
+from contextlib import contextmanager
+
+import torch
+
+class LatencyHistogram:
+    """
+    Rolling window of latency samples (in ms) with percentile summaries.
+    Only the last `window` samples are kept, so the percentiles follow the current load.
+    """
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, duration_ms: float):
+        self.samples.append(duration_ms)
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Nearest-rank percentile over the current window.
+        :param q: Percentile in [0, 100]
+        """
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = max(0, min(len(ordered) - 1, math.ceil(q / 100.0 * len(ordered)) - 1))
+        return ordered[rank]
+
+    def snapshot(self) -> dict:
+        window = len(self.samples)
+        return {
+            "count": self.count,
+            "window": window,
+            "mean_ms": round(sum(self.samples) / window, 3) if window else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(max(self.samples), 3) if window else 0.0,
+        }
+
+class InferenceProfiler:
+    """
+    Per-stage timers for the inference pipeline.
+    Each stage keeps its own rolling histogram, and a sampled fraction of requests
+    can be captured with torch.profiler (operator and per-layer tables + Chrome trace).
+    Captured requests are slowed down by the profiler, so they are kept out of the histograms.
+
+    The CLI handles one request per process, so with `log_path` every request is appended
+    to a JSONL file and the histograms start from its last `window` rows.
+    """
+    STAGES = ("preprocess", "encode", "decode", "threshold", "serialize")
+
+    def __init__(self, window: int = 1000, trace_dir: str = None, trace_rate: float = 0.0, log_path: str = None):
+        self.histograms = {name: LatencyHistogram(window) for name in self.STAGES}
+        self.total = LatencyHistogram(window)
+        self.trace_dir = trace_dir
+        self.trace_rate = trace_rate
+        self.log_path = log_path
+        self.traces_captured = 0
+        self.last_request = {}
+        self.modules = {}
+        self.layer_labels = set()
+        self._capturing = False
+        if log_path:
+            self._load_log()
+
+    def _load_log(self):
+        """
+        Replay the last `window` logged requests into the histograms.
+        The log is compacted to those rows once it grows past twice the window.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        window = self.total.samples.maxlen
+        with open(self.log_path) as f:
+            lines = [line for line in f if line.strip()]
+        if len(lines) > 2 * window:
+            lines = lines[-window:]
+            with open(self.log_path + ".tmp", "w") as f:
+                f.writelines(lines)
+            os.replace(self.log_path + ".tmp", self.log_path)
+        for line in lines[-window:]:
+            row = json.loads(line)
+            for name, duration_ms in row["stages"].items():
+                self.histograms.setdefault(name, LatencyHistogram(window)).record(duration_ms)
+            self.total.record(row["total_ms"])
+
+    def _append_log(self, total_ms: float):
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        row = {
+            "time": round(time.time(), 3),
+            "stages": {name: round(ms, 3) for name, ms in self.last_request.items()},
+            "total_ms": round(total_ms, 3),
+        }
+        # One short line per write, so concurrent CLI processes don't interleave rows
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+
+    def watch(self, name: str, module: torch.nn.Module):
+        """
+        Register a model whose layers should be labelled individually in captured traces.
+        """
+        self.modules[name] = module
+
+    def _label_layers(self):
+        """
+        Install forward hooks that wrap every leaf layer in a record_function range,
+        so the operator table can be read per layer (e.g. "encoder.features.4.0.conv1").
+        Returns the hook handles so they can be removed after the capture.
+        """
+        handles = []
+        for prefix, model in self.modules.items():
+            for sub_name, layer in model.named_modules():
+                if any(True for _ in layer.children()):
+                    continue
+                label = f"{prefix}.{sub_name}" if sub_name else prefix
+                self.layer_labels.add(label)
+                ranges = []
+
+                def pre_hook(module, inputs, label=label, ranges=ranges):
+                    ranges.append(torch.profiler.record_function(label))
+                    ranges[-1].__enter__()
+
+                def post_hook(module, inputs, output, ranges=ranges):
+                    ranges.pop().__exit__(None, None, None)
+
+                handles.append(layer.register_forward_pre_hook(pre_hook))
+                handles.append(layer.register_forward_hook(post_hook))
+        return handles
+
+    @staticmethod
+    def _synchronize():
+        # CUDA kernels run asynchronously; without a sync the time lands in whichever stage waits first
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time one pipeline stage. The stage is also labelled for torch.profiler traces.
+        The duration is always kept in `last_request`, but only untraced requests reach the histogram.
+        """
+        histogram = self.histograms.setdefault(name, LatencyHistogram(self.total.samples.maxlen))
+        with torch.profiler.record_function(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._synchronize()
+                duration_ms = (time.perf_counter() - start) * 1000
+                if not self._capturing:
+                    histogram.record(duration_ms)
+                self.last_request[name] = duration_ms
+
+    @contextmanager
+    def request(self):
+        """
+        Time one full request. When sampled, the request runs under torch.profiler
+        and its operator table, per-layer table and Chrome trace are written to `trace_dir`
+        once the request has been timed. Sampled requests are not recorded or logged.
+        """
+        self.last_request = {}
+        capture = bool(self.trace_dir) and random.random() < self.trace_rate
+        start = time.perf_counter()
+        if capture:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            handles = self._label_layers()
+            self._capturing = True
+            try:
+                with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+                    yield
+            finally:
+                self._capturing = False
+                for handle in handles:
+                    handle.remove()
+            self.last_request["total"] = (time.perf_counter() - start) * 1000
+            self._export_trace(prof)
+            return
+        yield
+        total_ms = (time.perf_counter() - start) * 1000
+        self.total.record(total_ms)
+        if self.log_path:
+            self._append_log(total_ms)
+        self.last_request["total"] = total_ms
+
+    def _export_trace(self, prof):
+        os.makedirs(self.trace_dir, exist_ok=True)
+        stem = os.path.join(self.trace_dir, f"inference_{int(time.time() * 1000)}_{self.traces_captured}")
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        with open(stem + "_ops.txt", "w") as f:
+            f.write(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=50))
+        # Layer ranges have almost no self time, so they get their own table ranked by inclusive time
+        layer_sort = "device_time_total" if torch.cuda.is_available() else "cpu_time_total"
+        layers = [event for event in prof.key_averages() if event.key in self.layer_labels]
+        layers.sort(key=lambda event: getattr(event, layer_sort), reverse=True)
+        with open(stem + "_layers.txt", "w") as f:
+            f.write(f"{'layer':<48}  {'calls':>5}  {'total_ms':>10}  {'avg_ms':>8}\n")
+            for event in layers:
+                total_ms = getattr(event, layer_sort) / 1000
+                f.write(f"{event.key:<48}  {event.count:>5}  {total_ms:>10.3f}  {total_ms / event.count:>8.3f}\n")
+        prof.export_chrome_trace(stem + "_trace.json")
+        self.traces_captured += 1
+
+    def snapshot(self) -> dict:
+        """
+        Structured view of all histograms, safe to serialize as JSON.
+        """
+        return {
+            "stages": {name: hist.snapshot() for name, hist in self.histograms.items()},
+            "total": self.total.snapshot(),
+            "last_request_ms": {name: round(ms, 3) for name, ms in self.last_request.items()},
+            "traces_captured": self.traces_captured,
+        }
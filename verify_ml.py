@@ -2,12 +2,16 @@
 import torch
 import sys
 import os
+import tempfile
+from PIL import Image
 
 # Add project root to path so we can import ml_engine
 sys.path.append(os.getcwd())
 
 from ml_engine.services.inference import ModelInferenceService
-from ml_engine.models.gan import VoxelDiscriminator
+from ml_engine.models.gan import VoxelDiscriminator, VoxelGANGenerator, LightweightEncoder, ENCODERS
+from ml_engine.utils.profiling import LatencyHistogram, InferenceProfiler
+from ml_engine.sweep import expand_spec, halving_budgets
 
 def test_architecture():
     print("--- Testing ML Architecture ---")
@@ -48,5 +52,127 @@ def test_architecture():
     except Exception as e:
          print(f"[Fail] Discriminator: {e}")
 
+    # 5. Test Profiler
+    try:
+        histogram = LatencyHistogram()
+        for duration_ms in range(1, 6):
+            histogram.record(duration_ms)
+        if histogram.percentile(50) == 3 and histogram.percentile(100) == 5:
+            print("[Pass] Nearest-Rank Percentiles")
+        else:
+            print(f"[Fail] p50 of 1..5 is {histogram.percentile(50)}, expected 3")
+
+        log_path = os.path.join(tempfile.mkdtemp(), "latency.jsonl")
+        profiler = InferenceProfiler(log_path=log_path)
+        profiled = ModelInferenceService(device="cpu", profiler=profiler)
+        with profiler.request():
+            image_tensor = profiled.preprocess(Image.new("RGB", (64, 64)))
+            profiled.serialize(profiled.threshold(profiled.generate_from_image(image_tensor)))
+        stages = profiler.snapshot()["stages"]
+        if all(stages[name]["count"] == 1 for name in InferenceProfiler.STAGES):
+            print("[Pass] Snapshot Covers Every Stage")
+        else:
+            print(f"[Fail] Stage Counts: {({name: stats['count'] for name, stats in stages.items()})}")
+
+        # A new profiler (i.e. the next CLI run) starts from the logged request
+        if InferenceProfiler(log_path=log_path).snapshot()["total"]["count"] == 1:
+            print("[Pass] Latency Log Persists Across Runs")
+        else:
+            print("[Fail] Latency Log Not Replayed")
+    except Exception as e:
+        print(f"[Fail] Profiler: {e}")
+
+    # 6. Test Sweep Spec Helpers
+    try:
+        if halving_budgets(1, 9, 3) == [1, 3, 9]:
+            print("[Pass] Successive Halving Budgets")
+        else:
+            print(f"[Fail] Budgets for (1, 9, 3): {halving_budgets(1, 9, 3)}")
+
+        configs = expand_spec({"method": "grid", "params": {"lr": [1e-4, 2e-4, 5e-4], "batch_size": [4, 8]}})
+        if len(configs) == 6 and len({(c["lr"], c["batch_size"]) for c in configs}) == 6:
+            print("[Pass] Grid Expands to Every Combination")
+        else:
+            print(f"[Fail] Grid Produced {len(configs)} Configs, expected 6")
+
+        invalid_specs = {
+            "unknown parameter": lambda: expand_spec({"params": {"momentum": [0.9]}}),
+            "empty grid": lambda: expand_spec({"params": {"lr": []}}),
+            "eta < 2": lambda: halving_budgets(1, 9, 1),
+            "fractional eta": lambda: halving_budgets(1, 9, 2.5),
+        }
+        accepted = []
+        for name, check in invalid_specs.items():
+            try:
+                check()
+                accepted.append(name)
+            except ValueError:
+                pass
+        if not accepted:
+            print("[Pass] Invalid Sweep Specs Rejected")
+        else:
+            print(f"[Fail] Accepted Invalid Specs: {accepted}")
+    except Exception as e:
+        print(f"[Fail] Sweep Spec Helpers: {e}")
+
+    # 7. Test Lightweight Encoder
+    try:
+        student = ENCODERS["lightweight"](width=8).eval()
+        with torch.no_grad():
+            latent = student(dummy_image)
+        if isinstance(student, LightweightEncoder) and latent.shape == (1, 256):
+            print("[Pass] Lightweight Encoder Output Shape is Correct (1, 256)")
+        else:
+            print(f"[Fail] Lightweight Encoder Output Shape: {tuple(latent.shape)}")
+
+        student_path = os.path.join(tempfile.mkdtemp(), "student.pth")
+        torch.save({
+            'encoder_type': 'lightweight',
+            'encoder_kwargs': {'width': 8},
+            'encoder': student.state_dict(),
+            'generator': VoxelGANGenerator().state_dict(),
+        }, student_path)
+        # Built from the checkpoint alone, without a ResNet18 in between
+        student_service = ModelInferenceService(weights_path=student_path, device="cpu")
+        if isinstance(student_service.encoder, LightweightEncoder) and student_service.encoder_kwargs == {'width': 8}:
+            print("[Pass] Student Checkpoint Loads Through ENCODERS")
+        else:
+            print(f"[Fail] Student Checkpoint Built {type(student_service.encoder).__name__}")
+    except Exception as e:
+        print(f"[Fail] Lightweight Encoder: {e}")
+
+    # 8. Test Sparse Refinement (parity-matrix rewrite of the final layer)
+    try:
+        generator = VoxelGANGenerator().eval()
+        z = torch.randn(2, 256)
+        with torch.no_grad():
+            dense = generator(z)
+            features = generator.decode_coarse(z)
+            # max_occupancy=1.0 forces the sparse path instead of the dense fallback
+            full_mask = torch.ones(2, 1, 16, 16, 16, dtype=torch.bool)
+            full = generator.decode_sparse(features, full_mask, max_occupancy=1.0)
+            half_mask = torch.rand(2, 1, 16, 16, 16) < 0.5
+            half = generator.decode_sparse(features, half_mask, max_occupancy=1.0)
+
+        if torch.equal(generator.decode_fine(features), dense):
+            print("[Pass] decode_coarse + decode_fine Equals forward")
+        else:
+            print("[Fail] Coarse/Fine Split Mismatch")
+
+        error = (full - dense).abs().max().item()
+        print(f"Sparse vs Dense Max Error: {error:.2e}")
+        if error <= 1e-6:
+            print("[Pass] Sparse Refinement Matches Dense Output")
+        else:
+            print("[Fail] Sparse Refinement Mismatch")
+
+        covered = half_mask.repeat_interleave(2, 2).repeat_interleave(2, 3).repeat_interleave(2, 4)
+        if (half[~covered] == 0).all() and (half[covered] - dense[covered]).abs().max().item() <= 1e-6:
+            print("[Pass] Cells Outside the Mask Are Empty")
+        else:
+            print("[Fail] Masked Sparse Refinement")
+    except Exception as e:
+        print(f"[Fail] Sparse Refinement: {e}")
+
 if __name__ == "__main__":
     test_architecture()